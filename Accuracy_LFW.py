@@ -2,24 +2,32 @@ import json
 import subprocess
 import ipfshttpclient
 import numpy as np
-import faiss
 from tqdm import tqdm
 from sklearn import metrics
 from sklearn.metrics import confusion_matrix
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
+from Face_Gallery import write_gallery, open_gallery
 
 # === CONFIG ===
 CHANNEL_NAME = "mychannel"
 CHAINCODE_NAME = "cidrecord"
 PLOT_DIR = "evaluation_plots"
+EVAL_GALLERY_PATH = "evaluation_gallery.bin"  # full-precision copy, never the listeners' int8 gallery
+EVAL_MODE = "full"           # "full" = every pair, "sampled" = all genuine + sampled impostor pairs
+IMPOSTOR_SAMPLES = 200000    # impostor pairs drawn in sampled mode (capped at the number that exist)
+BOOTSTRAP_ROUNDS = 500       # resamples for the confidence intervals
+CONFIDENCE = 0.95
+PAIR_CHUNK = 65536           # pairs scored per vectorized step
+RANDOM_SEED = 42
 os.makedirs(PLOT_DIR, exist_ok=True)
 
 # === IPFS Connection ===
 ipfs = ipfshttpclient.connect("/ip4/127.0.0.1/tcp/5001")
 
-# === Load vectors from blockchain/IPFS ===
+# === Load vectors from blockchain/IPFS into a float32 evaluation gallery ===
+# Metrics must not depend on whether a listener's quantized (possibly partial) gallery exists
 def load_vectors():
     print("📥 Downloading vectors from IPFS via blockchain records...")
 
@@ -35,15 +43,15 @@ def load_vectors():
 
     if result.returncode != 0:
         print("❌ Blockchain query failed:", result.stderr)
-        return [], []
+        return None
 
     try:
         cid_records = json.loads(result.stdout)
     except Exception as e:
         print("❌ Failed to parse CID records:", e)
-        return [], []
+        return None
 
-    vectors, labels = [], []
+    vectors, ids, labels = [], [], []
     for record in tqdm(cid_records):
         try:
             cid = record["cid"]
@@ -52,22 +60,188 @@ def load_vectors():
 
             vector = obj["vector"]
             label = obj.get("label", None)
-            if label is not None and len(vector) == 128:
+            if len(vector) == 128:
                 vectors.append(np.array(vector, dtype=np.float32))
+                ids.append(record["id"])
                 labels.append(label)
         except Exception as e:
             print(f"⚠ Failed for {record.get('id')}: {e}")
 
-    return vectors, labels
+    if not vectors:
+        return None
+    # Full precision, and kept apart from the listeners' production gallery
+    write_gallery(EVAL_GALLERY_PATH, vectors, ids, labels, dtype="float32")
+    return open_gallery(EVAL_GALLERY_PATH)
+
+# === Sampled evaluation helpers ===
+# All within-identity pairs, grouped by identity in np.unique order; identity c owns
+# pairs[starts[c]:starts[c] + counts[c]], so bootstrap rounds only index into them
+def genuine_pairs(labels):
+    classes, inverse, sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    groups = np.split(np.argsort(inverse, kind="stable"), np.cumsum(sizes)[:-1])
+    firsts, seconds = [], []
+    for group in groups:
+        a, b = np.triu_indices(len(group), k=1)
+        firsts.append(group[a])
+        seconds.append(group[b])
+    counts = sizes * (sizes - 1) // 2
+    starts = np.cumsum(counts) - counts
+    return np.concatenate(firsts), np.concatenate(seconds), starts, counts
+
+# Genuine pairs of a bootstrap sample, one block per drawn identity
+def gather_pairs(first, second, starts, counts, drawn):
+    sizes = counts[drawn]
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    idx = np.repeat(starts[drawn], sizes) + np.arange(sizes.sum()) - offsets
+    return first[idx], second[idx]
+
+# Number of distinct impostor pairs, so sampling never draws more than full enumeration
+def impostor_population(identities):
+    _, counts = np.unique(identities, return_counts=True)
+    return (len(identities) ** 2 - int((counts.astype(np.int64) ** 2).sum())) // 2
+
+# Stratified by the first image's group: each group gets a share of the samples
+# proportional to the number of impostor pairs it takes part in. `identities` (default:
+# the labels) decides what counts as an impostor, so duplicated bootstrap clusters of
+# one person never pair with each other.
+def sample_impostor_pairs(labels, n_samples, rng, identities=None):
+    identities = labels if identities is None else identities
+    if len(np.unique(identities)) < 2:
+        raise ValueError("impostor pairs need at least two identities")
+
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    members = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    id_values, id_inverse, id_counts = np.unique(identities, return_inverse=True, return_counts=True)
+    same_identity_rows = id_counts[id_inverse[members[starts]]]
+
+    weights = counts * (len(labels) - same_identity_rows)
+    quota = weights / weights.sum() * n_samples
+    alloc = np.floor(quota).astype(np.int64)
+    alloc[np.argsort(alloc - quota)[:n_samples - alloc.sum()]] += 1
+
+    strata = np.repeat(np.arange(len(classes)), alloc)
+    first = members[starts[strata] + rng.integers(0, counts[strata])]
+
+    # Every stratum with samples has a partner of another identity, so this terminates
+    second = rng.integers(0, len(labels), size=len(first))
+    same = identities[first] == identities[second]
+    while same.any():
+        second[same] = rng.integers(0, len(labels), size=same.sum())
+        same = identities[first] == identities[second]
+    return first, second
+
+# Draw identities with replacement; each draw becomes its own cluster of rows
+def resample_identities(labels, rng):
+    classes, inverse, counts = np.unique(labels, return_inverse=True, return_counts=True)
+    members = np.argsort(inverse, kind="stable")
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+
+    drawn = rng.integers(0, len(classes), len(classes))
+    sizes = counts[drawn]
+    offsets = np.repeat(np.cumsum(sizes) - sizes, sizes)
+    rows = members[np.repeat(starts[drawn], sizes) + np.arange(sizes.sum()) - offsets]
+    clusters = np.repeat(np.arange(len(drawn)), sizes)
+    return rows, clusters, drawn
+
+def pair_scores(vectors, first, second):
+    scores = np.empty(len(first), dtype=np.float64)
+    for start in range(0, len(first), PAIR_CHUNK):
+        stop = start + PAIR_CHUNK
+        diff = vectors[first[start:stop]] - vectors[second[start:stop]]
+        scores[start:stop] = 1 - (diff ** 2).sum(axis=1) / 4
+    return scores
+
+def error_rates(genuine, impostor):
+    y_true = np.concatenate([np.ones(len(genuine)), np.zeros(len(impostor))])
+    y_scores = np.concatenate([genuine, impostor])
+    fpr, tpr, thresholds = metrics.roc_curve(y_true, y_scores)
+    auc = metrics.auc(fpr, tpr)
+    fnr = 1 - tpr
+    eer_index = np.nanargmin(np.abs(fnr - fpr))
+    eer = (fpr[eer_index] + fnr[eer_index]) / 2
+    return auc, eer, thresholds[eer_index], fpr, tpr
+
+def evaluate_sampled(vectors, labels):
+    rng = np.random.default_rng(RANDOM_SEED)
+
+    if len(np.unique(labels)) < 2:
+        print("❌ Sampled evaluation needs at least two labelled identities.")
+        return
+    genuine_first, genuine_second, pair_starts, pair_counts = genuine_pairs(labels)
+    if len(genuine_first) == 0:
+        print("❌ No identity has two or more images, so there are no genuine pairs.")
+        return
+
+    print("🔍 Scoring all genuine pairs and sampled impostor pairs...")
+    genuine = pair_scores(vectors, genuine_first, genuine_second)
+    n_impostor = min(IMPOSTOR_SAMPLES, impostor_population(labels))
+    impostor = pair_scores(vectors, *sample_impostor_pairs(labels, n_impostor, rng))
+    print(f"🔢 {len(genuine)} genuine pairs, {len(impostor)} sampled impostor pairs")
+
+    auc, eer, eer_threshold, fpr, tpr = error_rates(genuine, impostor)
+    far = np.mean(impostor >= eer_threshold)
+    frr = np.mean(genuine < eer_threshold)
+
+    # === Cluster bootstrap: pairs sharing an image or identity are correlated, so
+    # resample identities and rebuild the genuine pairs and impostor strata from them ===
+    boot = []
+    for _ in tqdm(range(BOOTSTRAP_ROUNDS)):
+        rows, clusters, drawn = resample_identities(labels, rng)
+        identities = labels[rows]
+        g_first, g_second = gather_pairs(genuine_first, genuine_second, pair_starts, pair_counts, drawn)
+        if len(g_first) == 0 or len(np.unique(identities)) < 2:
+            continue
+        n_impostor = min(IMPOSTOR_SAMPLES, impostor_population(identities))
+        i_first, i_second = sample_impostor_pairs(clusters, n_impostor, rng, identities)
+        g = pair_scores(vectors, g_first, g_second)
+        i = pair_scores(vectors, rows[i_first], rows[i_second])
+        b_auc, b_eer, _, _, _ = error_rates(g, i)
+        boot.append((b_auc, b_eer, np.mean(i >= eer_threshold), np.mean(g < eer_threshold)))
+    if not boot:
+        print("❌ No bootstrap round had both genuine and impostor pairs.")
+        return
+    alpha = (1 - CONFIDENCE) / 2
+    low, high = np.quantile(np.array(boot), [alpha, 1 - alpha], axis=0)
+
+    pct = int(CONFIDENCE * 100)
+    print("\n🎯 Evaluation Metrics (sampled):")
+    print(f"AUC: {auc:.4f} ({pct}% CI {low[0]:.4f}-{high[0]:.4f})")
+    print(f"EER: {eer:.4f} ({pct}% CI {low[1]:.4f}-{high[1]:.4f}) (at threshold {eer_threshold:.4f})")
+    print(f"FAR: {far:.4f} ({pct}% CI {low[2]:.4f}-{high[2]:.4f})")
+    print(f"FRR: {frr:.4f} ({pct}% CI {low[3]:.4f}-{high[3]:.4f})")
+
+    # === ROC Curve Plot ===
+    plt.figure()
+    plt.plot(fpr, tpr, label=f"AUC = {auc:.4f}")
+    plt.plot([0, 1], [0, 1], 'k--')
+    plt.xlabel("False Positive Rate")
+    plt.ylabel("True Positive Rate")
+    plt.title("ROC Curve (sampled impostors)")
+    plt.legend(loc="lower right")
+    plt.grid()
+    plt.savefig(os.path.join(PLOT_DIR, "roc_curve_sampled.png"))
+    plt.close()
+
+    print(f"\n📊 Graphs saved in ./{PLOT_DIR}/")
 
 # === Evaluation ===
 def evaluate():
-    vectors, labels = load_vectors()
-    if len(vectors) == 0:
+    gallery = load_vectors()
+    if gallery is None or len(gallery) == 0:
         print("❌ No valid vectors found.")
         return
 
+    # Only labelled (LFW) vectors take part in the evaluation
+    labelled = np.flatnonzero(gallery.labels >= 0)
+    vectors = gallery.get_vectors(labelled)
+    labels = np.asarray(gallery.labels[labelled])
+
     print(f"🔢 Loaded {len(vectors)} vectors")
+    if EVAL_MODE == "sampled":
+        evaluate_sampled(vectors, labels)
+        return
+
     sims, y_true = [], []
 
     print("🔍 Computing pairwise similarity...")
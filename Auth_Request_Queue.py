@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import uuid
+
+# === CONFIG ===
+SPOOL_DIR = "auth_requests"
+LEASE_TIMEOUT = 30  # seconds before a claimed request is handed to another consumer
+MAX_CLAIM = 16      # requests claimed per consumer cycle
+MAX_ATTEMPTS = 5    # deliveries before a request is completed with an error
+DONE_TTL = 24 * 3600  # seconds a result stays in done/ (must be well above LEASE_TIMEOUT)
+
+# === Spool layout ===
+# pending/<id>.<attempts>.json                   waiting for a consumer
+# leased/<id>.<attempts>.<consumer>.<nonce>.json claimed; mtime is the lease start, renewed by the holder
+# done/<id>.json                                 result of the single successful completion, kept for DONE_TTL
+# Every state change is a rename or hard link, so consumers on one host (or on
+# several hosts sharing the directory) never see a half-written request. The
+# attempt count travels in the name, so a request that keeps failing (or keeps
+# killing its consumer) is eventually completed with an error. The
+# consumer and a per-claim nonce in the leased name mean a holder whose lease
+# expired can no longer renew, release or delete the next holder's lease.
+
+def _dirs(spool_dir):
+    paths = tuple(os.path.join(spool_dir, d) for d in ("pending", "leased", "done"))
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+    return paths
+
+def _parse_name(name):
+    parts = name.split(".")
+    attempts = int(parts[1]) if len(parts) > 2 else 0
+    return parts[0], attempts
+
+def _write_json(path, obj):
+    with open(path, "w") as f:
+        json.dump(obj, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+
+# === Producer side ===
+def enqueue(request, spool_dir=SPOOL_DIR):
+    pending_dir, _, _ = _dirs(spool_dir)
+    request_id = f"{time.time_ns()}-{uuid.uuid4().hex}"
+    tmp_path = os.path.join(spool_dir, f".{request_id}.tmp")
+    _write_json(tmp_path, request)
+    os.replace(tmp_path, os.path.join(pending_dir, f"{request_id}.0.json"))
+    return request_id
+
+# === Consumer side ===
+class Lease:
+    def __init__(self, request_id, request, path, attempts):
+        self.request_id = request_id
+        self.request = request
+        self.path = path  # this holder's own leased file
+        self.attempts = attempts  # deliveries so far, including this one
+
+# Claim up to max_items pending requests; whoever renames a file first owns it
+def claim(consumer_id, max_items=MAX_CLAIM, spool_dir=SPOOL_DIR, max_attempts=MAX_ATTEMPTS):
+    pending_dir, leased_dir, done_dir = _dirs(spool_dir)
+    owner = consumer_id.replace(".", "_")
+    leases = []
+
+    for name in sorted(os.listdir(pending_dir)):
+        if len(leases) >= max_items:
+            break
+        if not name.endswith(".json"):
+            continue
+        request_id, attempts = _parse_name(name)
+        attempts += 1
+        src = os.path.join(pending_dir, name)
+        dst = os.path.join(leased_dir, f"{request_id}.{attempts}.{owner}.{uuid.uuid4().hex}.json")
+        try:
+            os.utime(src)  # the rename keeps mtime, so stamp the lease start first
+            os.rename(src, dst)
+        except FileNotFoundError:
+            continue  # another consumer got it
+
+        lease = Lease(request_id, None, dst, attempts)
+        if os.path.exists(os.path.join(done_dir, f"{request_id}.json")):
+            os.remove(dst)  # redelivered after it was already completed
+            continue
+        try:
+            with open(dst, "r") as f:
+                lease.request = json.load(f)
+            if not isinstance(lease.request, dict):
+                raise ValueError("request is not a JSON object")
+        except Exception as e:
+            print(f"⚠ Dropping unreadable request {request_id}: {e}")
+            complete(lease, {"error": str(e)}, spool_dir)
+            continue
+        if attempts > max_attempts:
+            print(f"⚠ Giving up on request {request_id} after {max_attempts} attempts")
+            complete(lease, {"hash": lease.request.get("hash"), "matched": False,
+                             "error": f"gave up after {max_attempts} attempts"}, spool_dir)
+            continue
+        leases.append(lease)
+
+    return leases
+
+def renew(lease):
+    try:
+        os.utime(lease.path)
+        return True
+    except FileNotFoundError:
+        return False  # lease expired and was handed to someone else
+
+# Give a lease back unprocessed (e.g. it cannot be served yet); this delivery is not counted.
+# Failed attempts should instead be left to expire, which backs off by LEASE_TIMEOUT.
+def release(lease, spool_dir=SPOOL_DIR):
+    pending_dir, _, _ = _dirs(spool_dir)
+    try:
+        os.rename(lease.path, os.path.join(pending_dir, f"{lease.request_id}.{lease.attempts - 1}.json"))
+        return True
+    except FileNotFoundError:
+        return False
+
+# Record the result exactly once; False means another consumer already completed it
+def complete(lease, result, spool_dir=SPOOL_DIR):
+    _, _, done_dir = _dirs(spool_dir)
+    tmp_path = os.path.join(spool_dir, f".{lease.request_id}.{uuid.uuid4().hex}.tmp")
+    _write_json(tmp_path, result)
+    try:
+        os.link(tmp_path, os.path.join(done_dir, f"{lease.request_id}.json"))
+        committed = True
+    except FileExistsError:
+        committed = False
+    finally:
+        os.remove(tmp_path)
+
+    try:
+        os.remove(lease.path)
+    except FileNotFoundError:
+        pass
+    return committed
+
+# Hand abandoned leases back to pending so another consumer picks them up,
+# and delete results older than done_ttl
+def requeue_expired(lease_timeout=LEASE_TIMEOUT, spool_dir=SPOOL_DIR, done_ttl=DONE_TTL):
+    pending_dir, leased_dir, done_dir = _dirs(spool_dir)
+    now = time.time()
+    requeued = 0
+
+    for name in os.listdir(done_dir):
+        path = os.path.join(done_dir, name)
+        try:
+            if now - os.path.getmtime(path) >= done_ttl:
+                os.remove(path)
+        except FileNotFoundError:
+            continue
+
+    for name in os.listdir(leased_dir):
+        path = os.path.join(leased_dir, name)
+        request_id, attempts = _parse_name(name)
+        try:
+            if now - os.path.getmtime(path) < lease_timeout:
+                continue
+            if os.path.exists(os.path.join(done_dir, f"{request_id}.json")):
+                os.remove(path)  # completed, holder died before cleaning up
+                continue
+            os.rename(path, os.path.join(pending_dir, f"{request_id}.{attempts}.json"))
+            requeued += 1
+        except FileNotFoundError:
+            continue
+
+    return requeued
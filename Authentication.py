@@ -1,22 +1,23 @@
 import dlib
 import cv2
-import json
 import hashlib
 import numpy as np
 from datetime import datetime, timezone
-import os
+from Auth_Request_Queue import SPOOL_DIR, enqueue
+from Face_Embedding import FaceQualityGate
 
 # === Paths ===
 SHAPE_PREDICTOR_PATH = "/home/biometric/1/notebooks/shape_predictor_68_face_landmarks.dat"
 FACE_RECOGNITION_MODEL_PATH = "/home/biometric/1/notebooks/dlib_face_recognition_resnet_model_v1.dat"
 IMAGE_PATH = "/home/biometric/1/person8.jpeg"
-AUTH_FILE = "auth_requests.json"
+CLAIMED_ID = None  # registered vector hash to verify against (1:1); None searches the whole gallery (1:N)
 
 # === Load models ===
 print("📦 Loading models...")
 detector = dlib.get_frontal_face_detector()
 shape_predictor = dlib.shape_predictor(SHAPE_PREDICTOR_PATH)
 face_rec_model = dlib.face_recognition_model_v1(FACE_RECOGNITION_MODEL_PATH)
+quality_gate = FaceQualityGate()
 
 # === Read Image ===
 print("🖼 Reading image...")
@@ -32,30 +33,32 @@ if len(faces) == 0:
     print("❌ No face detected.")
     exit(1)
 
+# === Check face quality before the descriptor ===
+reason = quality_gate.check_box(rgb_img, faces[0])
+if reason is None:
+    shape = shape_predictor(rgb_img, faces[0])
+    reason = quality_gate.check_pose(shape)
+if reason:
+    print(f"❌ Face rejected by quality gate: {reason}")
+    exit(1)
+
 # === Extract Vector ===
-shape = shape_predictor(rgb_img, faces[0])
 face_vector = np.array(face_rec_model.compute_face_descriptor(rgb_img, shape), dtype=np.float32)
 
 # === Hash the vector ===
 vector_hash = hashlib.sha256(face_vector.tobytes()).hexdigest()
 print(f"🔐 Vector hash: {vector_hash}")
 
-# === Append to auth_requests.json ===
+# === Queue the request for the authentication listeners ===
 request = {
     "hash": vector_hash,
     "vector": face_vector.tolist(),
     "timestamp": datetime.now(timezone.utc).isoformat()
 }
+if CLAIMED_ID:
+    request["claimed_id"] = CLAIMED_ID
 
-if os.path.exists(AUTH_FILE):
-    with open(AUTH_FILE, "r") as f:
-        data = json.load(f)
-else:
-    data = []
-
-data.append(request)
-
-with open(AUTH_FILE, "w") as f:
-    json.dump(data, f, indent=2)
+request_id = enqueue(request, SPOOL_DIR)
 
-print("✅ Authentication request recorded.")
+print(f"✅ Authentication request recorded: {request_id}")
+print(f"📄 Result will appear in {SPOOL_DIR}/done/{request_id}.json")
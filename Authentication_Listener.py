@@ -4,51 +4,59 @@ import hashlib
 import time
 import ipfshttpclient
 import numpy as np
-import faiss
 import os
-import subprocess
+import socket
+from collections import OrderedDict
+from Face_Gallery import GALLERY_PATH, GalleryBuilderLock, write_gallery, open_gallery, reopen_if_changed
+from Ledger_Query_Cache import LedgerQueryCache
+from Auth_Request_Queue import SPOOL_DIR, LEASE_TIMEOUT, MAX_CLAIM, MAX_ATTEMPTS, claim, renew, release, complete, requeue_expired
 
 # === CONFIG ===
 CHANNEL_NAME = "mychannel"
 CHAINCODE_NAME = "cidrecord"
-AUTH_FILE = "auth_requests.json"
+CONSUMER_ID = f"{socket.gethostname()}-{os.getpid()}"
 SIMILARITY_THRESHOLD = 0.95
+REFRESH_INTERVAL = 10  # seconds between background gallery syncs
+MAX_GALLERY_AGE = 600  # identification requests are held while the gallery is older than this
+TEMPLATE_CACHE_SIZE = 4096  # IPFS templates kept for 1:1 verification
 
 # === Connect to IPFS ===
 ipfs = ipfshttpclient.connect("/ip4/127.0.0.1/tcp/5001")
+ledger_cache = LedgerQueryCache(CHANNEL_NAME, CHAINCODE_NAME)  # gallery rebuilds (refresh thread)
+verify_cache = LedgerQueryCache(CHANNEL_NAME, CHAINCODE_NAME)  # 1:1 lookups, only touched by the event loop
 
-# === FAISS setup ===
+# === Gallery setup ===
+# The gallery lives in a compact memory-mapped file shared with other listeners/evaluators.
+# One listener per host holds the builder lock and rewrites the file; the others only remap
+# it when it changes. Requests are always served from `gallery`, and swapping the reference
+# lets in-flight searches keep using the mapping they started with.
 dimension = 128
-index = faiss.IndexFlatL2(dimension)
-hash_list = []
+gallery = open_gallery(GALLERY_PATH)
+builder_lock = GalleryBuilderLock(GALLERY_PATH)
+
+# CIDs are content addresses, so a cached template never goes stale
+template_cache = OrderedDict()
 
 # === Load all registered vectors from blockchain/IPFS ===
 def load_registered_vectors():
     print("📡 Querying blockchain for all registered vectors...")
 
-    result = subprocess.run([
-        "peer", "chaincode", "query",
-        "-C", CHANNEL_NAME,
-        "-n", CHAINCODE_NAME,
-        "-c", json.dumps({
-            "function": "GetAllCIDRecords",
-            "Args": []
-        })
-    ], capture_output=True, text=True)
+    result = ledger_cache.query("GetAllCIDRecords")
 
     if result.returncode != 0:
         print("❌ Blockchain query failed.")
         print(result.stderr)
-        return [], []
+        return [], [], [], False
 
     try:
         cid_records = json.loads(result.stdout)
     except Exception as e:
         print("❌ Failed to parse CID records:", e)
-        return [], []
+        return [], [], [], False
 
-    vectors = []
+    vectors = np.empty((len(cid_records), dimension), dtype=np.float32)
     hashes = []
+    labels = []
 
     for record in cid_records:
         try:
@@ -57,73 +65,198 @@ def load_registered_vectors():
             data = ipfs.cat(cid)
             obj = json.loads(data.decode("utf-8"))
 
+            label = None
             if isinstance(obj, dict) and "vector" in obj:
                 vector = np.array(obj["vector"], dtype=np.float32)
+                label = obj.get("label")
             else:
                 vector = np.array(obj, dtype=np.float32)
 
-            if len(vector) == 128:
-                vectors.append(vector)
+            if len(vector) == dimension:
+                vectors[len(hashes)] = vector
                 hashes.append(fid)
+                labels.append(label)
             else:
                 print(f"⚠ Invalid vector length for {fid}")
         except Exception as e:
             print(f"⚠ Failed to load from IPFS for {record.get('id')}: {e}")
 
-    return vectors, hashes
+    return vectors[:len(hashes)], hashes, labels, len(hashes) == len(cid_records)
+
+# === Build the next gallery from blockchain/IPFS ===
+def rebuild_gallery(current):
+    height = ledger_cache.current_height()
+    if current is not None and height is not None and current.ledger_height == height:
+        current.mark_current()  # ledger has not moved, so the gallery is still up to date
+        return current
+
+    vectors, known_hashes, known_labels, complete = load_registered_vectors()
+
+    # An empty ledger still gets a (count 0) gallery, so deleted identities stop matching;
+    # only a failed load keeps the current one
+    if not len(vectors) and not complete:
+        print("⚠ No vectors found on blockchain/IPFS.")
+        return None
+
+    # Only a gallery that loaded every record is tied to the height, so partial loads are retried
+    write_gallery(GALLERY_PATH, vectors, known_hashes, known_labels, ledger_height=height if complete else None)
+    return open_gallery(GALLERY_PATH)
+
+# === Background gallery refresh ===
+async def refresh_gallery_forever():
+    global gallery
+
+    while True:
+        try:
+            if builder_lock.try_acquire():
+                next_gallery = await asyncio.to_thread(rebuild_gallery, gallery)
+            else:
+                next_gallery = reopen_if_changed(gallery, GALLERY_PATH)
+            if next_gallery is not None and next_gallery is not gallery:
+                gallery = next_gallery
+                print(f"🔄 Gallery refreshed: {len(gallery)} identities")
+        except Exception as e:
+            print("❌ Gallery refresh failed:", e)
+
+        await asyncio.sleep(REFRESH_INTERVAL)
+
+# === Match one vector against a gallery snapshot ===
+def authenticate(vec, vec_hash, current):
+    D, I = current.search(vec, k=1)
+    if len(current):
+        sim = 1 - D[0][0] / 4  # cosine approximation from L2
+        sim = round(float(sim), 4)
+    else:
+        sim = None  # nobody is registered
+
+    matched = sim is not None and bool(sim >= SIMILARITY_THRESHOLD)
+    return {
+        "hash": vec_hash,
+        "mode": "identify",
+        "matched": matched,
+        "matched_hash": current.get_id(I[0][0]) if matched else None,
+        "similarity": sim,
+        "gallery_size": len(current),
+        "gallery_age": round(current.age(), 1),  # seconds since it was last known to match the ledger
+        "gallery_height": current.ledger_height,
+    }
+
+# === 1:1 verification against a claimed identity ===
+def fetch_template(cid):
+    vector = template_cache.get(cid)
+    if vector is not None:
+        template_cache.move_to_end(cid)
+        return vector
+
+    obj = json.loads(ipfs.cat(cid).decode("utf-8"))
+    vector = np.array(obj["vector"] if isinstance(obj, dict) else obj, dtype=np.float32)
+    template_cache[cid] = vector
+    if len(template_cache) > TEMPLATE_CACHE_SIZE:
+        template_cache.popitem(last=False)
+    return vector
+
+def verify(vec, vec_hash, claimed_id):
+    result = {"hash": vec_hash, "mode": "verify", "claimed_id": claimed_id, "matched": False, "matched_hash": None}
+
+    # This lookup is the only freshness check for a revoked identity, so it uses a
+    # cache the refresh thread never shares
+    record = verify_cache.query("ReadCIDRecord", [claimed_id])
+    if record.returncode != 0:
+        # Only the chaincode's own answer means "not registered"; anything else
+        # (peer down, TLS, missing Fabric env) is retried
+        if "does not exist" in record.stderr:
+            result["reason"] = "claimed identity not registered"
+            return result
+        raise RuntimeError(f"ReadCIDRecord failed: {record.stderr.strip()}")
+
+    template = fetch_template(json.loads(record.stdout)["cid"])
+    sim = round(float(1 - np.sum((vec - template) ** 2) / 4), 4)  # same score as the 1:N path
+    result["similarity"] = sim
+    if sim >= SIMILARITY_THRESHOLD:
+        result["matched"] = True
+        result["matched_hash"] = claimed_id
+    return result
+
+def gallery_ready(current):
+    return current is not None and current.age() <= MAX_GALLERY_AGE
 
 # === Handle authentication events ===
 async def listen_for_auth_events():
-    print("👂 Listening for authentication requests...")
+    print(f"👂 Listening for authentication requests as {CONSUMER_ID}...")
+    refresh_task = asyncio.create_task(refresh_gallery_forever())
 
     while True:
         try:
-            if not os.path.exists(AUTH_FILE):
-                await asyncio.sleep(2)
-                continue
+            if refresh_task.done():
+                print("⚠ Gallery refresher stopped, restarting it")
+                refresh_task = asyncio.create_task(refresh_gallery_forever())
 
-            with open(AUTH_FILE, "r") as f:
-                requests = json.load(f)
+            # Several listeners can run side by side; each claims its own leased requests
+            requeued = requeue_expired(LEASE_TIMEOUT, SPOOL_DIR)
+            if requeued:
+                print(f"♻ Re-queued {requeued} abandoned request(s)")
 
-            if not requests:
+            leases = claim(CONSUMER_ID, MAX_CLAIM, SPOOL_DIR)
+            if not leases:
                 await asyncio.sleep(2)
                 continue
 
-            vectors, known_hashes = load_registered_vectors()
+            current = gallery
+            waiting = 0
+            for lease in leases:
+                req = lease.request
+                vec_hash = claimed_id = None
+                try:
+                    vec_hash = req.get("hash")
+                    claimed_id = req.get("claimed_id")
 
-            if not vectors:
-                print("⚠ No vectors found on blockchain/IPFS.")
-                await asyncio.sleep(2)
-                continue
+                    # Claimed identities take the 1:1 path and never need the gallery;
+                    # identification waits for a gallery that is recent enough to trust
+                    if not claimed_id and not gallery_ready(current):
+                        release(lease, SPOOL_DIR)
+                        waiting += 1
+                        continue
 
-            index.reset()
-            hash_list.clear()
-            for vec, h in zip(vectors, known_hashes):
-                index.add(np.array([vec], dtype=np.float32))
-                hash_list.append(h)
-
-            updated_requests = []
-            for req in requests:
-                vec = np.array(req["vector"], dtype=np.float32)
-                vec_hash = req["hash"]
-                print(f"🔐 Authenticating vector with hash: {vec_hash}")
-
-                D, I = index.search(np.array([vec]), k=1)
-                sim = 1 - D[0][0] / 4  # cosine approximation from L2
-                sim = round(sim, 4)
-
-                if sim >= SIMILARITY_THRESHOLD:
-                    matched_hash = hash_list[I[0][0]]
-                    print(f"✅ Match found: {matched_hash} (Similarity: {sim})")
+                    print(f"🔐 Authenticating vector with hash: {vec_hash}")
+                    renew(lease)
+                    vec = np.array(req["vector"], dtype=np.float32)
+                    if claimed_id:
+                        result = verify(vec, vec_hash, claimed_id)
+                    else:
+                        result = authenticate(vec, vec_hash, current)
+                except (KeyError, ValueError, TypeError, AttributeError) as e:
+                    # A malformed request is completed with its error instead of being re-delivered forever
+                    result = {"hash": vec_hash, "matched": False, "error": str(e)}
+                except Exception as e:
+                    if lease.attempts < MAX_ATTEMPTS:
+                        # Leave the lease to expire so the retry waits LEASE_TIMEOUT instead of spinning
+                        print(f"⚠ Authentication of {vec_hash} failed (attempt {lease.attempts}/{MAX_ATTEMPTS}), will retry: {e}")
+                        continue
+                    result = {"hash": vec_hash, "matched": False, "error": f"gave up after {lease.attempts} attempts: {e}"}
+                result["consumer"] = CONSUMER_ID
+                if not complete(lease, result, SPOOL_DIR):
+                    print(f"ℹ Request {lease.request_id} was already completed by another consumer")
+                    continue
+
+                if "error" in result:
+                    print(f"❌ Failed to authenticate {vec_hash}: {result['error']}")
+                elif result["mode"] == "verify":
+                    status = "✅ Verified" if result["matched"] else "❌ Not verified"
+                    print(f"{status} as {claimed_id} (Similarity: {result.get('similarity')})")
+                    if "reason" in result:
+                        print(f"ℹ {result['reason']}")
+                elif result["matched"]:
+                    print(f"✅ Match found: {result['matched_hash']} (Similarity: {result['similarity']}, gallery age: {result['gallery_age']}s)")
                 else:
-                    print(f"❌ No match found (Similarity: {sim})")
+                    print(f"❌ No match found (Similarity: {result['similarity']}, gallery age: {result['gallery_age']}s)")
 
-                # After processing, don't reprocess same request
-                # So we don't add it to updated_requests
+            if waiting:
+                print(f"⏳ Waiting for an up-to-date gallery ({waiting} identification request(s) put back)")
+                await asyncio.sleep(2)
+                continue
 
-            # Clear the auth file after processing all
-            with open(AUTH_FILE, "w") as f:
-                json.dump([], f, indent=2)
+            await asyncio.sleep(0)  # keep draining, but let the refresher swap galleries in
+            continue
 
         except Exception as e:
             print("❌ Error:", e)
@@ -2,6 +2,7 @@ import time
 import subprocess
 import json
 import os
+from Ledger_Query_Cache import LedgerQueryCache
 
 FABRIC_DIR = "/home/biometric/1/fabric-samples"
 CHANNEL_NAME = "mychannel"
@@ -16,18 +17,10 @@ os.environ.update({
     "CORE_PEER_MSPCONFIGPATH": f"{FABRIC_DIR}/test-network/organizations/peerOrganizations/org1.example.com/users/Admin@org1.example.com/msp",
     "CORE_PEER_ADDRESS": "localhost:7051"
 })
+ledger_cache = LedgerQueryCache(CHANNEL_NAME, CHAINCODE_NAME)
 
 def get_all_records():
-    cmd = [
-        "peer", "chaincode", "query",
-        "-C", CHANNEL_NAME,
-        "-n", CHAINCODE_NAME,
-        "-c", json.dumps({
-            "function": "GetAllCIDRecords",
-            "Args": []
-        })
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True)
+    result = ledger_cache.query("GetAllCIDRecords")
     try:
         return json.loads(result.stdout)
     except:
@@ -54,6 +47,7 @@ def delete_record(hash_id):
     ]
     result = subprocess.run(cmd, capture_output=True, text=True)
     if result.returncode == 0:
+        ledger_cache.invalidate()
         print(f"✅ Deleted hash {hash_id} successfully.")
     else:
         print(f"❌ Failed to delete {hash_id}. Error:\n{result.stderr}")
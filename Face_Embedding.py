@@ -0,0 +1,99 @@
+import math
+import cv2
+import dlib
+import numpy as np
+
+# === CONFIG ===
+BATCH_SIZE = 64       # aligned faces per compute_face_descriptor call
+DESCRIPTOR_DIM = 128
+CHIP_SIZE = 150       # dlib ResNet input size
+CHIP_PADDING = 0.25   # same padding compute_face_descriptor(img, shape) uses
+
+# === Quality gate thresholds ===
+MIN_FACE_SIZE = 40    # px, shorter side of the detection box
+MIN_SHARPNESS = 30.0  # variance of the Laplacian inside the detection box
+MAX_YAW = 0.35        # nose-tip offset from the eye midpoint along the eye axis, as a fraction of eye distance
+MAX_ROLL_DEG = 30.0   # tilt of the line through the outer eye corners
+
+# === Cheap face-quality pre-filter ===
+# Runs before the ResNet descriptor so tiny, blurred or strongly turned faces are
+# dropped early. check_box() only needs the detection; check_pose() needs the
+# 68-point landmarks. Both return None when the face passes, else the reason.
+class FaceQualityGate:
+    def __init__(self, min_face_size=MIN_FACE_SIZE, min_sharpness=MIN_SHARPNESS, max_yaw=MAX_YAW, max_roll_deg=MAX_ROLL_DEG):
+        self.min_face_size = min_face_size
+        self.min_sharpness = min_sharpness
+        self.max_yaw = max_yaw
+        self.max_roll_deg = max_roll_deg
+        self.counters = {"checked": 0, "passed": 0, "too_small": 0, "blurry": 0, "bad_pose": 0}
+
+    def _reject(self, reason):
+        self.counters[reason] += 1
+        return reason
+
+    def check_box(self, img, det):
+        self.counters["checked"] += 1
+        if min(det.width(), det.height()) < self.min_face_size:
+            return self._reject("too_small")
+
+        top, bottom = max(det.top(), 0), min(det.bottom(), img.shape[0])
+        left, right = max(det.left(), 0), min(det.right(), img.shape[1])
+        face = img[top:bottom, left:right]
+        if face.ndim == 3:
+            face = cv2.cvtColor(face, cv2.COLOR_RGB2GRAY)
+        if face.size == 0 or cv2.Laplacian(face, cv2.CV_64F).var() < self.min_sharpness:
+            return self._reject("blurry")
+        return None
+
+    def check_pose(self, shape):
+        left_eye, right_eye, nose = shape.part(36), shape.part(45), shape.part(30)
+        dx, dy = right_eye.x - left_eye.x, right_eye.y - left_eye.y
+        eye_dist = math.hypot(dx, dy)
+        if eye_dist == 0:
+            return self._reject("bad_pose")
+
+        # Project onto the eye axis so in-plane tilt (roll) does not read as yaw
+        mid_x, mid_y = (left_eye.x + right_eye.x) / 2, (left_eye.y + right_eye.y) / 2
+        yaw = abs((nose.x - mid_x) * dx + (nose.y - mid_y) * dy) / eye_dist ** 2
+        roll = abs(math.degrees(math.atan2(dy, dx)))
+        if yaw > self.max_yaw or roll > self.max_roll_deg:
+            return self._reject("bad_pose")
+
+        self.counters["passed"] += 1
+        return None
+
+    def stats(self):
+        return dict(self.counters)
+
+# === Batched face embedding ===
+# Faces are aligned to 150x150 chips first, then the ResNet runs once per batch of
+# chips and writes straight into a float32 matrix instead of one call per face.
+class FaceEmbedder:
+    def __init__(self, detector, predictor, face_rec_model, batch_size=BATCH_SIZE, quality_gate=None):
+        self.detector = detector
+        self.predictor = predictor
+        self.face_rec_model = face_rec_model
+        self.batch_size = batch_size
+        self.quality_gate = quality_gate
+
+    # Detect the first face and return its aligned chip (None if no usable face)
+    def align(self, img_rgb, upsample=1):
+        dets = self.detector(img_rgb, upsample)
+        if len(dets) == 0:
+            return None
+        if self.quality_gate is not None and self.quality_gate.check_box(img_rgb, dets[0]):
+            return None
+        shape = self.predictor(img_rgb, dets[0])
+        if self.quality_gate is not None and self.quality_gate.check_pose(shape):
+            return None
+        return dlib.get_face_chip(img_rgb, shape, size=CHIP_SIZE, padding=CHIP_PADDING)
+
+    # Descriptors for a list of aligned chips, as rows of an (n, 128) float32 matrix
+    def embed(self, chips, out=None):
+        if out is None:
+            out = np.empty((len(chips), DESCRIPTOR_DIM), dtype=np.float32)
+
+        for start in range(0, len(chips), self.batch_size):
+            batch = chips[start:start + self.batch_size]
+            out[start:start + len(batch)] = self.face_rec_model.compute_face_descriptor(batch)
+        return out
@@ -0,0 +1,224 @@
+import os
+import json
+import time
+import fcntl
+import struct
+import numpy as np
+
+# === CONFIG ===
+GALLERY_PATH = "face_gallery.bin"
+DEFAULT_DTYPE = "int8"   # "float32", "float16" or "int8" (scalar-quantized)
+SEARCH_CHUNK = 65536     # rows scored per search step
+MAGIC = b"FGALLRY1"
+ALIGN = 64
+ID_WIDTH = 64            # SHA-256 hex digest
+
+# === On-disk layout ===
+# MAGIC | uint64 header length | JSON header | vectors | ids | labels | norms
+# Every block starts on a 64-byte boundary so it can be memory-mapped directly.
+# norms holds the squared L2 norm of every stored (dequantized) row, so search never
+# has to dequantize the int8 block.
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+def _quantize(vectors, dtype):
+    if dtype == "float32":
+        return vectors.astype(np.float32, copy=False), None, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None, None
+    if dtype == "int8":
+        lo = vectors.min(axis=0) if len(vectors) else np.zeros(vectors.shape[1], np.float32)
+        hi = vectors.max(axis=0) if len(vectors) else np.ones(vectors.shape[1], np.float32)
+        scale = np.maximum(hi - lo, 1e-12) / 255.0
+        q = np.rint((vectors - lo) / scale) - 128
+        return np.clip(q, -128, 127).astype(np.int8), scale.astype(np.float32), lo.astype(np.float32)
+    raise ValueError(f"Unsupported gallery dtype: {dtype}")
+
+def _dequantize(block, scale, offset):
+    if scale is None:
+        return np.asarray(block, dtype=np.float32)
+    return (block.astype(np.float32) + 128) * scale + offset
+
+def _row_norms(data, scale, offset):
+    norms = np.empty(len(data), dtype=np.float32)
+    for start in range(0, len(data), SEARCH_CHUNK):
+        block = _dequantize(data[start:start + SEARCH_CHUNK], scale, offset)
+        norms[start:start + len(block)] = (block ** 2).sum(axis=1)
+    return norms
+
+# === Write a gallery file (atomically replaces any existing one) ===
+def write_gallery(path, vectors, ids, labels=None, dtype=DEFAULT_DTYPE, created_at=None, dim=128, ledger_height=None):
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(len(ids), dim)
+    count, dim = vectors.shape
+    data, scale, offset = _quantize(vectors, dtype)
+    id_table = np.array([str(i).encode("utf-8") for i in ids], dtype=f"S{ID_WIDTH}")
+    if labels is None:
+        labels = np.full(count, -1, dtype=np.int32)
+    label_table = np.asarray([-1 if l is None else l for l in labels], dtype=np.int32)
+    norm_table = _row_norms(data, scale, offset)
+
+    header = {
+        "count": count,
+        "dim": dim,
+        "dtype": dtype,
+        "id_width": ID_WIDTH,
+        "scale": None if scale is None else scale.tolist(),
+        "offset": None if offset is None else offset.tolist(),
+        "created_at": time.time() if created_at is None else created_at,
+        "ledger_height": ledger_height,  # block height the contents are known to match, if any
+    }
+    # Offsets depend on the header size, so settle them with a fixed-width placeholder first
+    header.update(vectors_offset=0, ids_offset=0, labels_offset=0, norms_offset=0)
+    head_len = len(json.dumps(header).encode("utf-8")) + 4 * 20
+    vectors_offset = _align(len(MAGIC) + 8 + head_len)
+    ids_offset = _align(vectors_offset + data.nbytes)
+    labels_offset = _align(ids_offset + id_table.nbytes)
+    norms_offset = _align(labels_offset + label_table.nbytes)
+    header.update(vectors_offset=vectors_offset, ids_offset=ids_offset, labels_offset=labels_offset, norms_offset=norms_offset)
+    header_bytes = json.dumps(header).encode("utf-8")
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        blocks = ((data, vectors_offset), (id_table, ids_offset), (label_table, labels_offset), (norm_table, norms_offset))
+        for block, block_offset in blocks:
+            f.seek(block_offset)
+            f.write(block.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    # Readers that already mapped the old file keep their pages until they reopen
+    os.replace(tmp_path, path)
+
+# === Memory-mapped, read-only view of a gallery file ===
+class Gallery:
+    def __init__(self, path=GALLERY_PATH):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a face gallery file")
+            (head_len,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(head_len).decode("utf-8"))
+            self.inode = os.fstat(f.fileno()).st_ino
+
+        self.count = header["count"]
+        self.dim = header["dim"]
+        self.dtype = header["dtype"]
+        self.created_at = header["created_at"]
+        self.ledger_height = header.get("ledger_height")
+        self.scale = None if header["scale"] is None else np.array(header["scale"], dtype=np.float32)
+        self.offset = None if header["offset"] is None else np.array(header["offset"], dtype=np.float32)
+
+        if self.count:
+            self.vectors = np.memmap(path, dtype=np.dtype(self.dtype), mode="r",
+                                     offset=header["vectors_offset"], shape=(self.count, self.dim))
+            self.ids = np.memmap(path, dtype=f"S{header['id_width']}", mode="r",
+                                 offset=header["ids_offset"], shape=(self.count,))
+            self.labels = np.memmap(path, dtype=np.int32, mode="r",
+                                    offset=header["labels_offset"], shape=(self.count,))
+            if "norms_offset" in header:
+                self.norms = np.memmap(path, dtype=np.float32, mode="r",
+                                       offset=header["norms_offset"], shape=(self.count,))
+            else:
+                self.norms = _row_norms(self.vectors, self.scale, self.offset)  # file from before norms were stored
+        else:
+            self.vectors = np.empty((0, self.dim), dtype=np.dtype(self.dtype))
+            self.ids = np.empty(0, dtype=f"S{header['id_width']}")
+            self.labels = np.empty(0, dtype=np.int32)
+            self.norms = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return self.count
+
+    # The builder touches the file whenever it confirms the ledger has not moved, so
+    # mtime is when these contents were last known to match the chain
+    def age(self):
+        try:
+            st = os.stat(self.path)
+            if st.st_ino == self.inode:
+                return time.time() - st.st_mtime
+        except FileNotFoundError:
+            pass
+        return time.time() - self.created_at
+
+    def mark_current(self):
+        try:
+            if os.stat(self.path).st_ino == self.inode:
+                os.utime(self.path)
+        except FileNotFoundError:
+            pass
+
+    def get_id(self, i):
+        return self.ids[i].decode("utf-8")
+
+    def get_vectors(self, rows=None):
+        block = self.vectors if rows is None else self.vectors[rows]
+        return _dequantize(block, self.scale, self.offset)
+
+    # Brute-force L2 search straight over the mapped pages (same results as IndexFlatL2)
+    def search(self, queries, k=1):
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, self.count)
+        best_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+        best_i = np.full((len(queries), k), -1, dtype=np.int64)
+        if k == 0:
+            return best_d, best_i
+
+        # int8 rows are (x + 128) * scale + offset, so fold scale and offset into the
+        # query instead: q . row = (q * scale) . x + q . (128 * scale + offset)
+        q_norms = (queries ** 2).sum(axis=1, keepdims=True)
+        if self.scale is not None:
+            q_scaled = queries * self.scale
+            q_const = (queries @ (128 * self.scale + self.offset))[:, None]
+        else:
+            q_scaled, q_const = queries, 0
+        for start in range(0, self.count, SEARCH_CHUNK):
+            block = self.vectors[start:start + SEARCH_CHUNK]
+            dots = q_scaled @ block.T.astype(np.float32, copy=False) + q_const
+            dists = q_norms + self.norms[start:start + len(block)] - 2 * dots
+            np.maximum(dists, 0, out=dists)
+
+            cand_d = np.concatenate([best_d, dists], axis=1)
+            cand_i = np.concatenate([best_i, np.broadcast_to(np.arange(start, start + len(block)), dists.shape)], axis=1)
+            top = np.argsort(cand_d, axis=1, kind="stable")[:, :k]
+            best_d = np.take_along_axis(cand_d, top, axis=1)
+            best_i = np.take_along_axis(cand_i, top, axis=1)
+
+        return best_d, best_i
+
+def open_gallery(path=GALLERY_PATH):
+    if not os.path.exists(path):
+        return None
+    return Gallery(path)
+
+# Every write_gallery() lands on a new inode, so readers only remap when it changes
+def reopen_if_changed(current, path=GALLERY_PATH):
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        return current
+    if current is not None and current.inode == inode:
+        return current
+    return Gallery(path)
+
+# === Single builder per gallery file ===
+# Only the process holding this lock rebuilds the gallery; everyone else maps the
+# file it writes, so all listeners and evaluators on a host share the same pages.
+class GalleryBuilderLock:
+    def __init__(self, path=GALLERY_PATH):
+        self.lock_path = f"{path}.lock"
+        self.fd = None
+
+    def try_acquire(self):
+        if self.fd is not None:
+            return True
+        fd = os.open(self.lock_path, os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self.fd = fd  # held until the process exits
+        return True
@@ -0,0 +1,92 @@
+import os
+import json
+import cv2
+import numpy as np
+
+# === CONFIG ===
+LFW_DIR = os.path.expanduser("~/scikit_learn_data/lfw_home/lfw_funneled")
+CACHE_DIR = "lfw_cache"
+MIN_FACES_PER_PERSON = 10
+CHUNK_SIZE = 256
+# Same crop fetch_lfw_people applies by default (125x94 at resize=1.0)
+SLICE = (slice(70, 195), slice(78, 172))
+FACE_SIZE = 150  # crops are resized to FACE_SIZE x FACE_SIZE before they are cached
+
+# === Index the local LFW folders the way fetch_lfw_people does ===
+def index_lfw(lfw_dir=LFW_DIR, min_faces_per_person=MIN_FACES_PER_PERSON):
+    if not os.path.isdir(lfw_dir):
+        raise FileNotFoundError(f"LFW not found at {lfw_dir}; download it once with sklearn.datasets.fetch_lfw_people(funneled=True)")
+
+    person_names, file_paths = [], []
+    for person_name in sorted(os.listdir(lfw_dir)):
+        folder_path = os.path.join(lfw_dir, person_name)
+        if not os.path.isdir(folder_path):
+            continue
+        paths = [os.path.join(folder_path, f) for f in sorted(os.listdir(folder_path))]
+        if len(paths) >= min_faces_per_person:
+            person_names.extend([person_name.replace("_", " ")] * len(paths))
+            file_paths.extend(paths)
+
+    target_names = np.unique(person_names)
+    target = np.searchsorted(target_names, person_names)
+
+    # fetch_lfw_people shuffles with a fixed seed; keep the same order and labels
+    indices = np.arange(len(file_paths))
+    np.random.RandomState(42).shuffle(indices)
+    file_paths = [file_paths[i] for i in indices]
+    return file_paths, target[indices], target_names
+
+# Decode one image straight into the layout the embedder takes (RGB, FACE_SIZE square),
+# so cached chunks need no per-image conversion
+def load_face(path):
+    img = cv2.imread(path)
+    if img is None:
+        raise ValueError(f"Could not read {path}")
+    return cv2.resize(cv2.cvtColor(img[SLICE], cv2.COLOR_BGR2RGB), (FACE_SIZE, FACE_SIZE))
+
+# === Chunked, memory-bounded reader over a uint8 on-disk cache ===
+# The first pass decodes the JPEGs into a memory-mapped .npy while yielding them;
+# later passes only map the cache. Either way at most one chunk is resident.
+class LFWStream:
+    def __init__(self, lfw_dir=LFW_DIR, cache_dir=CACHE_DIR, min_faces_per_person=MIN_FACES_PER_PERSON, chunk_size=CHUNK_SIZE):
+        self.file_paths, self.target, self.target_names = index_lfw(lfw_dir, min_faces_per_person)
+        self.chunk_size = chunk_size
+        self.cache_dir = cache_dir
+        self.images_path = os.path.join(cache_dir, f"images_min{min_faces_per_person}.npy")
+        self.meta_path = os.path.join(cache_dir, f"meta_min{min_faces_per_person}.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def __len__(self):
+        return len(self.file_paths)
+
+    def num_chunks(self):
+        return (len(self) + self.chunk_size - 1) // self.chunk_size
+
+    def _cache_is_valid(self):
+        if not (os.path.exists(self.images_path) and os.path.exists(self.meta_path)):
+            return False
+        with open(self.meta_path, "r") as f:
+            meta = json.load(f)
+        return meta.get("file_paths") == self.file_paths and meta.get("face_size") == FACE_SIZE
+
+    def __iter__(self):
+        if self._cache_is_valid():
+            images = np.load(self.images_path, mmap_mode="r")
+            for start in range(0, len(self), self.chunk_size):
+                stop = start + self.chunk_size
+                yield start, images[start:stop], self.target[start:stop]
+            return
+
+        partial_path = self.images_path + ".partial"
+        images = np.lib.format.open_memmap(partial_path, mode="w+", dtype=np.uint8, shape=(len(self), FACE_SIZE, FACE_SIZE, 3))
+        for start in range(0, len(self), self.chunk_size):
+            stop = min(start + self.chunk_size, len(self))
+            for i in range(start, stop):
+                images[i] = load_face(self.file_paths[i])
+            yield start, images[start:stop], self.target[start:stop]
+
+        images.flush()
+        del images
+        os.replace(partial_path, self.images_path)
+        with open(self.meta_path, "w") as f:
+            json.dump({"file_paths": self.file_paths, "face_size": FACE_SIZE}, f)
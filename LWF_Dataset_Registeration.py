@@ -1,15 +1,17 @@
 import os
-import cv2
 import dlib
 import json
 import hashlib
 import subprocess
 import numpy as np
-from sklearn.datasets import fetch_lfw_people
 from tqdm import tqdm
+from Ledger_Query_Cache import LedgerQueryCache
+from Face_Embedding import FaceEmbedder, FaceQualityGate, BATCH_SIZE, DESCRIPTOR_DIM
+from LFW_Stream import LFWStream, LFW_DIR
 
 # === CONFIG ===
 UNCONFIRMED_DIR = "unconfirmed_vectors"
+ENROLLED_LOG = "lfw_enrolled.jsonl"  # one {"source", "hash"} line per registered LFW image
 FABRIC_DIR = "/home/biometric/1/fabric-samples"
 CHANNEL_NAME = "mychannel"
 CHAINCODE_NAME = "cidrecord"
@@ -25,58 +27,60 @@ os.environ.update({
     "CORE_PEER_ADDRESS": "localhost:7051"
 })
 os.makedirs(UNCONFIRMED_DIR, exist_ok=True)
+ledger_cache = LedgerQueryCache(CHANNEL_NAME, CHAINCODE_NAME)
 
 # === Dlib models ===
 print("📦 Loading models...")
 detector = dlib.get_frontal_face_detector()
 predictor = dlib.shape_predictor("/home/biometric/1/notebooks/shape_predictor_68_face_landmarks.dat")
 face_rec_model = dlib.face_recognition_model_v1("/home/biometric/1/notebooks/dlib_face_recognition_resnet_model_v1.dat")
+quality_gate = FaceQualityGate()
+embedder = FaceEmbedder(detector, predictor, face_rec_model, batch_size=BATCH_SIZE, quality_gate=quality_gate)
+batch_vectors = np.empty((BATCH_SIZE, DESCRIPTOR_DIM), dtype=np.float32)
 
-# === Load LFW dataset ===
-print("📥 Loading LFW...")
-lfw = fetch_lfw_people(min_faces_per_person=10, color=True, resize=1.0, funneled=True)
-
-images = lfw.images
-labels = lfw.target
+# === Stream LFW dataset ===
+# Images arrive as 150x150 RGB uint8 chunks from an on-disk cache, ready for the embedder
+print("📥 Indexing LFW...")
+lfw = LFWStream(min_faces_per_person=10, chunk_size=BATCH_SIZE)
 label_names = lfw.target_names
 
 print("🔐 Registering all LFW vectors to IPFS + Blockchain...")
 
-# === Extract and register face vectors ===
-def extract_vector(img):
-    if img.dtype != np.uint8:
-        img = (img * 255).astype(np.uint8)
-    img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB) if img.shape[-1] == 3 else cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
-    img_resized = cv2.resize(img_rgb, (150, 150))  # Resize consistently
-    dets = detector(img_resized, 1)
-    if len(dets) == 0:
-        return None
-    shape = predictor(img_resized, dets[0])
-    vec = face_rec_model.compute_face_descriptor(img_resized, shape)
-    return list(vec)
-
-for i in tqdm(range(len(images))):
-    vec = extract_vector(images[i])
-    if vec is None:
-        continue
+# === Ids already on the ledger, fetched once instead of one GetCID per image ===
+def load_registered_ids():
+    result = ledger_cache.query("GetAllCIDRecords")
+    if result.returncode != 0:
+        raise RuntimeError(f"Blockchain query failed: {result.stderr}")
+    return {record["id"] for record in json.loads(result.stdout or "[]")}
+
+registered_ids = load_registered_ids()
+print(f"ℹ {len(registered_ids)} records already on the ledger")
 
-    label = int(labels[i])
+# === Dedupe by source image ===
+# Descriptors from the batched path are not bit-identical to the old per-image ones, so
+# a re-run cannot recognise an image by its vector hash. Each image is instead recorded
+# by its path under LFW_DIR and skipped while its record is still on the ledger.
+# Enrolments made before this log existed are not in it; clear them before re-enrolling.
+def load_enrolled_sources():
+    enrolled = {}
+    if os.path.exists(ENROLLED_LOG):
+        with open(ENROLLED_LOG, "r") as f:
+            for line in f:
+                entry = json.loads(line)
+                enrolled[entry["source"]] = entry["hash"]
+    return {source for source, vector_hash in enrolled.items() if vector_hash in registered_ids}
+
+enrolled_sources = load_enrolled_sources()
+enrolled_log = open(ENROLLED_LOG, "a")
+
+# === Register one face vector ===
+def register_vector(vec, label, source):
     vector_json = json.dumps({"vector": vec, "label": label})
     vector_hash = hashlib.sha256(vector_json.encode("utf-8")).hexdigest()
 
     # Check if already registered
-    check_cmd = [
-        "peer", "chaincode", "query",
-        "-C", CHANNEL_NAME,
-        "-n", CHAINCODE_NAME,
-        "-c", json.dumps({
-            "function": "GetCID",
-            "Args": [vector_hash]
-        })
-    ]
-    result = subprocess.run(check_cmd, capture_output=True, text=True)
-    if "CID" in result.stdout:
-        continue  # Already registered
+    if vector_hash in registered_ids:
+        return  # Already registered
 
     # Emit RegisterHash event
     register_cmd = [
@@ -99,8 +103,36 @@ for i in tqdm(range(len(images))):
     result = subprocess.run(register_cmd, capture_output=True, text=True)
     if result.returncode != 0:
         print(f"❌ Blockchain error: {result.stderr}")
-        continue
+        return
+    ledger_cache.invalidate()
+    registered_ids.add(vector_hash)
+    enrolled_log.write(json.dumps({"source": source, "hash": vector_hash}) + "\n")
+    enrolled_log.flush()
 
     # Save vector for listener
     with open(f"{UNCONFIRMED_DIR}/{vector_hash}.json", "w") as f:
         json.dump({"hash": vector_hash, "vector": vec, "label": label}, f)
+
+# === Extract and register face vectors ===
+for start, images, labels in tqdm(lfw, total=lfw.num_chunks()):
+    chips, chip_labels, chip_sources = [], [], []
+    for i, (img, label) in enumerate(zip(images, labels)):
+        source = os.path.relpath(lfw.file_paths[start + i], LFW_DIR)
+        if source in enrolled_sources:
+            continue  # Already registered
+        chip = embedder.align(img)
+        if chip is not None:
+            chips.append(chip)
+            chip_labels.append(int(label))
+            chip_sources.append(source)
+    if not chips:
+        continue
+
+    vectors = embedder.embed(chips, out=batch_vectors[:len(chips)])
+    for vec, label, source in zip(vectors, chip_labels, chip_sources):
+        register_vector(vec.tolist(), label, source)
+
+enrolled_log.close()
+
+print(f"📊 Ledger query cache: {ledger_cache.stats()}")
+print(f"📊 Face quality gate: {quality_gate.stats()}")
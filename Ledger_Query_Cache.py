@@ -0,0 +1,108 @@
+import json
+import time
+import threading
+import subprocess
+
+# === CONFIG ===
+CHANNEL_NAME = "mychannel"
+CHAINCODE_NAME = "cidrecord"
+HEIGHT_CHECK_INTERVAL = 2.0  # seconds a known block height is trusted before re-checking
+
+# === Cache for read-only `peer chaincode query` results ===
+# Entries are keyed by (function, args) and dropped whenever the channel block
+# height advances or this client commits a transaction of its own. Safe to share
+# between threads: an answer is only stored if no invalidation happened while its
+# query was running, so a read from before a commit is never kept as current.
+class LedgerQueryCache:
+    def __init__(self, channel=CHANNEL_NAME, chaincode=CHAINCODE_NAME, height_check_interval=HEIGHT_CHECK_INTERVAL):
+        self.channel = channel
+        self.chaincode = chaincode
+        self.height_check_interval = height_check_interval
+        self.entries = {}
+        self.generation = 0  # bumped on every invalidation
+        self.lock = threading.Lock()
+        self.height = None
+        self.height_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # === Channel block height via `peer channel getinfo` ===
+    def block_height(self):
+        result = subprocess.run(["peer", "channel", "getinfo", "-c", self.channel], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None
+        for line in result.stdout.splitlines():
+            if line.startswith("Blockchain info:"):
+                try:
+                    return json.loads(line.split(":", 1)[1])["height"]
+                except Exception:
+                    return None
+        return None
+
+    # Callers hold self.lock
+    def _refresh_height(self):
+        now = time.monotonic()
+        if now - self.height_checked_at < self.height_check_interval:
+            return
+        height = self.block_height()
+        self.height_checked_at = now
+        # An unknown height means nothing can be trusted, so drop everything
+        if height is None or height != self.height:
+            self._invalidate()
+        self.height = height
+
+    def query(self, function, args=()):
+        key = (function, tuple(args))
+        with self.lock:
+            self._refresh_height()
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.hits += 1
+                return cached
+            self.misses += 1
+            generation = self.generation
+
+        result = subprocess.run([
+            "peer", "chaincode", "query",
+            "-C", self.channel,
+            "-n", self.chaincode,
+            "-c", json.dumps({
+                "function": function,
+                "Args": list(args)
+            })
+        ], capture_output=True, text=True)
+
+        # Only successful answers are cached; failures are retried next time
+        with self.lock:
+            if result.returncode == 0 and generation == self.generation:
+                self.entries[key] = result
+        return result
+
+    # Block height as of at most height_check_interval ago (None if unknown)
+    def current_height(self):
+        with self.lock:
+            self._refresh_height()
+            return self.height
+
+    # Call after this client commits a transaction (invoke) so reads see it
+    def invalidate(self):
+        with self.lock:
+            self._invalidate()
+
+    def _invalidate(self):
+        self.invalidations += 1
+        self.generation += 1
+        self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "entries": len(self.entries),
+                "invalidations": self.invalidations,
+                "block_height": self.height,
+            }
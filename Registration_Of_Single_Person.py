@@ -5,6 +5,7 @@ import json
 import hashlib
 import subprocess
 import numpy as np
+from Face_Embedding import FaceQualityGate
 
 # === CONFIG ===
 IMAGE_PATH = "/home/biometric/1/person3.jpeg"
@@ -32,6 +33,7 @@ print("📦 Loading models...")
 detector = dlib.get_frontal_face_detector()
 predictor = dlib.shape_predictor("/home/biometric/1/notebooks/shape_predictor_68_face_landmarks.dat")
 face_rec_model = dlib.face_recognition_model_v1("/home/biometric/1/notebooks/dlib_face_recognition_resnet_model_v1.dat")
+quality_gate = FaceQualityGate()
 
 # === Load image and extract vector ===
 print("🖼 Reading image...")
@@ -46,7 +48,15 @@ if len(faces) == 0:
     print("❌ No face detected.")
     exit(1)
 
-shape = predictor(gray, faces[0])
+# === Check face quality before the descriptor ===
+reason = quality_gate.check_box(gray, faces[0])
+if reason is None:
+    shape = predictor(gray, faces[0])
+    reason = quality_gate.check_pose(shape)
+if reason:
+    print(f"❌ Face rejected by quality gate: {reason}")
+    exit(1)
+
 vector = list(face_rec_model.compute_face_descriptor(image, shape))
 
 # === Hash the vector using SHA-256 ===